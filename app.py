@@ -13,13 +13,16 @@ uvicorn app:app --host 0.0.0.0 --port 10000
 متغيرات البيئة:
 APP_URL, DB_PATH, SALLA_* ، WABA_TOKEN (اختياري لكل متجر)، WABA_PHONE_ID (اختياري لكل متجر)
 """
-import os, json, time, hmac, hashlib, sqlite3, secrets
+import os, time, gzip, hmac, asyncio, hashlib, logging, sqlite3, secrets, threading
 from typing import Optional, Dict, Any, List
 from urllib.parse import urlencode
 
 import httpx
+import orjson
 from fastapi import FastAPI, Request, HTTPException
-from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse, PlainTextResponse
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import HTMLResponse, ORJSONResponse, RedirectResponse, PlainTextResponse, Response
+from starlette.middleware.gzip import GZipMiddleware
 
 # ================= إعدادات عامة =================
 APP_URL           = os.getenv("APP_URL", "https://your-app.onrender.com").rstrip("/")
@@ -31,6 +34,7 @@ SALLA_AUTH_URL    = os.getenv("SALLA_AUTH_URL", "https://accounts.salla.sa/oauth
 SALLA_TOKEN_URL   = os.getenv("SALLA_TOKEN_URL", "https://accounts.salla.sa/oauth2/token")
 SALLA_API_BASE    = os.getenv("SALLA_API_BASE", "https://api.salla.dev/admin")  # عدّل حسب بيئتك
 SALLA_WEBHOOK_SEC = os.getenv("SALLA_WEBHOOK_SECRET", "change-me")
+SALLA_WEBHOOK_SEC_BYTES = SALLA_WEBHOOK_SEC.encode()  # لا نعيد ترميز المفتاح مع كل طلب
 
 # WhatsApp Cloud API — يمكن لكل متجر تعيين مفاتيحه داخل اللوحة
 GLOBAL_WABA_TOKEN    = os.getenv("WABA_TOKEN", "")
@@ -41,6 +45,16 @@ WABA_API_BASE        = os.getenv("WABA_API_BASE", "https://graph.facebook.com/v2
 os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
 conn = sqlite3.connect(DB_PATH, check_same_thread=False)
 conn.row_factory = sqlite3.Row
+# WAL + ضبط PRAGMA: قراءات متزامنة أثناء الكتابة، وتقليل fsync لكل commit
+for _pragma in (
+    "journal_mode=WAL",
+    "synchronous=NORMAL",
+    "temp_store=MEMORY",
+    "cache_size=-64000",
+    "mmap_size=268435456",
+    "busy_timeout=5000",
+):
+    conn.execute(f"PRAGMA {_pragma}")
 cur  = conn.cursor()
 
 cur.execute("""CREATE TABLE IF NOT EXISTS merchants (
@@ -92,11 +106,148 @@ cur.execute("""CREATE TABLE IF NOT EXISTS logs (
   created_at INTEGER
 )""")
 
+# ترحيل: عمود updated_at للقوالب — يغذي ETag نداءات اللوحة
+if "updated_at" not in {r[1] for r in cur.execute("PRAGMA table_info(templates)").fetchall()}:
+    cur.execute("ALTER TABLE templates ADD COLUMN updated_at INTEGER")
+
+# فهارس للاستعلامات حسب المتجر — بدونها تتحول قراءات events/logs إلى مسح كامل مع نمو الجداول
+cur.execute("CREATE INDEX IF NOT EXISTS ix_events_store_created ON events(store_id, created_at DESC)")
+cur.execute("CREATE INDEX IF NOT EXISTS ix_logs_store_created ON logs(store_id, created_at DESC)")
+
 conn.commit()
 
+log = logging.getLogger("app")
+
 def now() -> int:
     return int(time.time())
 
+# تنفيذ استعلامات SQLite خارج حلقة الأحداث (event loop) حتى لا يعطّل fsync بقية الطلبات
+# ملاحظة: conn.execute ينشئ مؤشرًا جديدًا لكل نداء — المؤشر الواحد لا يُشارك بين خيوط متزامنة
+# حالة المعاملة (commit/rollback) مشتركة على الاتصال الواحد، فكل عمل قاعدة على خيوط
+# الـ threadpool يمر تحت هذا القفل حتى لا يُنهي خيط معاملة خيط آخر في منتصفها
+_DB_LOCK = threading.Lock()
+
+async def db_fetchone(sql: str, params=()) -> Optional[sqlite3.Row]:
+    def _fetch():
+        with _DB_LOCK:
+            return conn.execute(sql, params).fetchone()
+    return await run_in_threadpool(_fetch)
+
+async def db_fetchall(sql: str, params=()) -> List[sqlite3.Row]:
+    def _fetch():
+        with _DB_LOCK:
+            return conn.execute(sql, params).fetchall()
+    return await run_in_threadpool(_fetch)
+
+async def db_write(sql: str, params=()):
+    def _write():
+        with _DB_LOCK:
+            conn.execute(sql, params)
+            conn.commit()
+    await run_in_threadpool(_write)
+
+# طابور كتابة مؤجّل لسجلات events/logs — دفعة executemany واحدة (و fsync واحد) بدل commit لكل صف
+EVENT_INSERT_SQL = "INSERT INTO events (store_id, event_type, payload, created_at) VALUES (?,?,?,?)"
+LOG_INSERT_SQL   = "INSERT INTO logs (store_id, to_msisdn, template, status, error, created_at) VALUES (?,?,?,?,?,?)"
+EVENT_Q: "asyncio.Queue[tuple]" = asyncio.Queue(maxsize=10_000)
+LOG_Q:   "asyncio.Queue[tuple]" = asyncio.Queue(maxsize=10_000)
+FLUSH_BATCH    = 500
+FLUSH_INTERVAL = 0.05  # ثانية
+
+def _enqueue(q: "asyncio.Queue[tuple]", row: tuple):
+    try:
+        q.put_nowait(row)
+    except asyncio.QueueFull:
+        # الطابور ممتلئ (نادر) — نُسقط الأقدم ونُدخل الجديد بدل كتابة متزامنة
+        # على خيط حلقة الأحداث (commit يعني fsync يجمّد كل الطلبات تحت الضغط)
+        try:
+            q.get_nowait()
+        except asyncio.QueueEmpty:
+            pass
+        q.put_nowait(row)
+
+async def _queue_flusher(q: "asyncio.Queue[tuple]", sql: str):
+    rows: List[tuple] = []
+    try:
+        while True:
+            if not rows:
+                rows.append(await q.get())
+            deadline = time.monotonic() + FLUSH_INTERVAL
+            while len(rows) < FLUSH_BATCH:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    # asyncio.timeout بدل wait_for — الأخير في 3.11 قد يبتلع الإلغاء
+                    # إذا اكتمل q.get في نفس لحظة cancel فلا تُغلق المهمة عند الإيقاف
+                    async with asyncio.timeout(remaining):
+                        rows.append(await q.get())
+                except TimeoutError:
+                    break
+
+            def _flush():
+                with _DB_LOCK:
+                    conn.executemany(sql, rows)
+                    conn.commit()
+            try:
+                await run_in_threadpool(_flush)
+            except sqlite3.Error:
+                # خطأ عابر (قفل طويل/قرص ممتلئ) يجب ألا يقتل المهمة إلى الأبد —
+                # نحتفظ بالدفعة ونعيد المحاولة بعد مهلة
+                log.exception("queue flusher: flush of %d rows failed, retrying", len(rows))
+                await asyncio.sleep(1.0)
+                continue
+            rows = []
+    finally:
+        # عند الإلغاء: أعد الدفعة المحلية إلى الطابور حتى يكتبها _drain_queues
+        for r in rows:
+            try:
+                q.put_nowait(r)
+            except asyncio.QueueFull:
+                break
+
+# تنظيف دوري: events/logs تنمو بلا حد فتتباطأ كل الاستعلامات ويتضخم ملف القاعدة
+RETENTION_DAYS     = int(os.getenv("RETENTION_DAYS", "30"))
+RETENTION_INTERVAL = 6 * 3600   # ثانية
+RETENTION_CHUNK    = 5000       # حذف على دفعات صغيرة حتى لا نحتجز قفل الكتابة طويلاً
+
+async def _retention_loop():
+    while True:
+        try:
+            cutoff = now() - RETENTION_DAYS * 86400
+            for table in ("events", "logs"):
+                while True:
+                    def _prune():
+                        with _DB_LOCK:
+                            c = conn.execute(f"DELETE FROM {table} WHERE rowid IN "
+                                             f"(SELECT rowid FROM {table} WHERE created_at < ? LIMIT ?)",
+                                             (cutoff, RETENTION_CHUNK))
+                            conn.commit()
+                            return c.rowcount
+                    deleted = await run_in_threadpool(_prune)
+                    if deleted < RETENTION_CHUNK:
+                        break
+                    await asyncio.sleep(0.1)  # تنفيس بين الدفعات
+            def _checkpoint():
+                with _DB_LOCK:
+                    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            await run_in_threadpool(_checkpoint)
+        except sqlite3.Error:
+            # خطأ عابر لا يقتل حلقة التنظيف — نحاول مجددًا في الدورة القادمة
+            log.exception("retention: prune failed, will retry next cycle")
+        await asyncio.sleep(RETENTION_INTERVAL)
+
+def _drain_queues():
+    # عند الإيقاف: أفرغ ما تبقى في الطوابير حتى لا تضيع صفوف
+    for q, sql in ((EVENT_Q, EVENT_INSERT_SQL), (LOG_Q, LOG_INSERT_SQL)):
+        rows = []
+        while not q.empty():
+            rows.append(q.get_nowait())
+        if rows:
+            with _DB_LOCK:
+                conn.executemany(sql, rows)
+                conn.commit()
+
 # =============== أدوات مساعدة ===================
 DEFAULT_SETTINGS = {
     "enabled": {
@@ -123,20 +274,127 @@ DEFAULT_TEMPLATES = [
 
 PLACEHOLDERS = ["{name}", "{order_no}", "{order_url}", "{tracking_no}"]
 
+# تعبئة القالب بمرور واحد على النص (format_map) بدل replace لكل متغير —
+# المتغير غير المعروف يبقى كما هو بدل أن يرمي KeyError
+class _SafeDict(dict):
+    def __missing__(self, key):
+        return "{" + key + "}"
+
+def render_template(body: str, **values: Any) -> str:
+    return body.format_map(_SafeDict(values))
+
+def validate_template(body: str) -> bool:
+    # تجربة جافة عند الحفظ حتى لا يرمي مسار الإرسال الساخن على أقواس مكسورة
+    # format_map قد يرمي أيضًا AttributeError مثل {order.no} و TypeError مثل {a[x]}
+    # و KeyError على مفاتيح غريبة — كل قالب فاسد يجب أن يعيد 400 لا 500
+    try:
+        body.format_map(_SafeDict())
+        return True
+    except (ValueError, IndexError, KeyError, AttributeError, TypeError):
+        return False
+
+# كاش داخل العملية للإعدادات والقوالب — تتغير نادرًا فلا داعي لضربة SQLite لكل طلب
+CACHE_TTL = 30.0  # ثوانٍ
+_SETTINGS_CACHE: Dict[str, tuple] = {}  # store_id -> (انتهاء الصلاحية, settings)
+_TPL_CACHE: Dict[str, tuple] = {}       # store_id -> (انتهاء الصلاحية, templates)
+
+def _cache_get(cache: Dict[str, tuple], store_id: str):
+    hit = cache.get(store_id)
+    if hit and hit[0] > time.monotonic():
+        return hit[1]
+    return None
+
+def _cache_put(cache: Dict[str, tuple], store_id: str, value):
+    cache[store_id] = (time.monotonic() + CACHE_TTL, value)
+
+def _cache_invalidate(store_id: str):
+    _SETTINGS_CACHE.pop(store_id, None)
+    _TPL_CACHE.pop(store_id, None)
+
+# ETag مشتق من updated_at — تحميل اللوحة المتكرر يصبح 304 بلا جسم
+def _etag_of(*parts: Any) -> str:
+    key = ":".join(str(p) for p in parts).encode()
+    return '"' + hashlib.blake2b(key, digest_size=8).hexdigest() + '"'
+
+def _json_with_etag(request: Request, content: Any, etag: str) -> Response:
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    return ORJSONResponse(content, headers={"ETag": etag, "Cache-Control": "private, no-cache"})
+
+# عميل HTTP مشترك (keep-alive + connection pooling) — يُنشأ عند الإقلاع ويُغلق عند الإيقاف
+http_client: Optional[httpx.AsyncClient] = None
+
+def get_http_client() -> httpx.AsyncClient:
+    global http_client
+    if http_client is None:  # احتياط لو استُدعي قبل startup (اختبارات مثلًا)
+        # مهلة دقيقة لكل مرحلة بدل 45 ثانية شاملة — نقطة نهاية معلّقة لا تحتجز العامل طويلاً
+        http_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(connect=5.0, read=15.0, write=10.0, pool=5.0),
+            limits=httpx.Limits(max_keepalive_connections=50, max_connections=100, keepalive_expiry=30),
+            http2=True,
+        )
+    return http_client
+
 async def http_post(url: str, headers: dict = None, data=None, json_=None):
-    async with httpx.AsyncClient(timeout=45) as client:
-        r = await client.post(url, headers=headers, data=data, json=json_)
-        r.raise_for_status()
-        return r
+    r = await get_http_client().post(url, headers=headers, data=data, json=json_)
+    r.raise_for_status()
+    return r
 
 async def http_get(url: str, headers: dict = None):
-    async with httpx.AsyncClient(timeout=45) as client:
-        r = await client.get(url, headers=headers)
-        r.raise_for_status()
-        return r
+    r = await get_http_client().get(url, headers=headers)
+    r.raise_for_status()
+    return r
 
 # =============== OAuth مع سلة (مختصر) =================
-app = FastAPI(title="Ferpoks WhatsApp AI – Salla App")
+app = FastAPI(title="Ferpoks WhatsApp AI – Salla App", default_response_class=ORJSONResponse)
+# ضغط ردود JSON النصية الكبيرة — الصفحات الثابتة مضغوطة مسبقًا فيتخطاها الوسيط
+app.add_middleware(GZipMiddleware, minimum_size=512, compresslevel=5)
+
+_flusher_tasks: List["asyncio.Task"] = []
+
+async def _warmup():
+    # تسخين بعد البرود (scale-to-zero على Render): عبارات SQL الساخنة تُجهَّز،
+    # محلل مسارات/اعتماديات FastAPI يُجمَّع، وجلسة TLS مع Meta تُفتح —
+    # فلا يدفع أول webhook حقيقي ثمن كل ذلك
+    def _prepare():
+        with _DB_LOCK:
+            conn.execute("SELECT 1 FROM merchants LIMIT 1").fetchone()
+            conn.execute("SELECT 1 FROM store_settings LIMIT 1").fetchone()
+            conn.execute("SELECT 1 FROM templates LIMIT 1").fetchone()
+    await run_in_threadpool(_prepare)
+    try:
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://warmup") as local:
+            await local.get("/health")
+            await local.get("/api/bootstrap")  # 404 بدون متجر — المهم تجميع المسار
+    except Exception:
+        pass
+    try:
+        await get_http_client().get(WABA_API_BASE, timeout=3)  # أفضل جهد — النتيجة لا تهم
+    except Exception:
+        pass
+
+@app.on_event("startup")
+async def _startup():
+    get_http_client()
+    _flusher_tasks.append(asyncio.create_task(_queue_flusher(EVENT_Q, EVENT_INSERT_SQL)))
+    _flusher_tasks.append(asyncio.create_task(_queue_flusher(LOG_Q, LOG_INSERT_SQL)))
+    _flusher_tasks.append(asyncio.create_task(_retention_loop()))
+    # لا نؤخر جاهزية المنفذ على التسخين — والمرجع في القائمة يمنع جمع المهمة
+    # قبل اكتمالها ويضمن إلغاءها النظيف عند الإيقاف
+    _flusher_tasks.append(asyncio.create_task(_warmup()))
+
+@app.on_event("shutdown")
+async def _shutdown():
+    global http_client
+    for t in _flusher_tasks:
+        t.cancel()
+    # ننتظر المهام الملغاة حتى تعيد كل دفعة محلية إلى الطابور قبل التفريغ
+    await asyncio.gather(*_flusher_tasks, return_exceptions=True)
+    _flusher_tasks.clear()
+    _drain_queues()
+    if http_client is not None:
+        await http_client.aclose()
+        http_client = None
 
 @app.get("/install")
 def install():
@@ -170,63 +428,92 @@ async def callback(code: Optional[str] = None, state: Optional[str] = None):
     exp         = now() + int(tok.get("expires_in", 3600))
 
     # TODO: اجلب بيانات المتجر من Salla API وضع store_id الحقيقي
-    store_id = f"store-{hash(access_tok)%999999}"
+    # بصمة ثابتة — hash() المدمجة عشوائية لكل عملية (PYTHONHASHSEED) فتولّد متجرًا جديدًا مع كل إعادة تشغيل
+    store_id = "store-" + hashlib.blake2b(access_tok.encode(), digest_size=8).hexdigest()
     store_domain = "example.salla.sa"
 
-    cur.execute("""
+    await db_write("""
         INSERT OR REPLACE INTO merchants (store_id, store_domain, access_token, refresh_token, token_expires_at, created_at)
         VALUES (?,?,?,?,?,?)
     """, (store_id, store_domain, access_tok, refresh_tok, exp, now()))
-    conn.commit()
 
-    ensure_defaults(store_id)
+    await ensure_defaults(store_id)
 
     return RedirectResponse(f"/dashboard?sid={store_id}")
 
 # =============== Webhook من سلة =====================
 
+def _persist_event(store_id: str, event_type: str, payload: Dict[str, Any]):
+    _enqueue(EVENT_Q, (store_id, event_type, orjson.dumps(payload).decode(), now()))
+
 @app.post("/webhook")
 async def webhook(request: Request):
     raw = await request.body()
     sig = request.headers.get("X-Signature", "")  # قد يختلف اسم الهيدر
     if SALLA_WEBHOOK_SEC:
-        digest = hmac.new(SALLA_WEBHOOK_SEC.encode(), raw, hashlib.sha256).hexdigest()
-        if not hmac.compare_digest(digest, sig or ""):
+        try:
+            sig_bytes = bytes.fromhex(sig)
+        except ValueError:
+            raise HTTPException(401, "Invalid signature")
+        digest = hmac.new(SALLA_WEBHOOK_SEC_BYTES, raw, hashlib.sha256).digest()
+        if not hmac.compare_digest(digest, sig_bytes):
             raise HTTPException(401, "Invalid signature")
 
-    payload = await request.json()
+    payload = orjson.loads(raw)
     event_type = payload.get("event") or payload.get("type", "unknown")
     store_id   = payload.get("store_id", "unknown")
 
-    cur.execute("INSERT INTO events (store_id, event_type, payload, created_at) VALUES (?,?,?,?)",
-                (store_id, event_type, json.dumps(payload, ensure_ascii=False), now()))
-    conn.commit()
+    # الإدراج في الطابور لا يلمس القرص — سلة لا تنتظر كتابة SQLite
+    _persist_event(store_id, event_type, payload)
 
     # يمكنك هنا وضع منطق الإرسال شبه الفوري (مع محدد سرعات لكل متجر)
     # للاختصار سيُدار الإرسال عبر /api/test-send عند التجربة
-    return JSONResponse({"ok": True})
+    return {"ok": True}
 
 # =============== وظائف البيانات =====================
 
-def ensure_defaults(store_id: str):
-    # إعدادات
-    row = cur.execute("SELECT settings_json FROM store_settings WHERE store_id=?", (store_id,)).fetchone()
+async def ensure_defaults(store_id: str):
+    def _seed():
+        # دفعة واحدة: قفل كتابة واحد و fsync واحد بدل واحد لكل قالب
+        # تحت _DB_LOCK — وإلا قد يصادف BEGIN IMMEDIATE معاملة ضمنية مفتوحة من خيط آخر
+        with _DB_LOCK:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                ts = now()
+                conn.executemany(
+                    "INSERT OR IGNORE INTO templates (store_id, tkey, display_name, body, updated_at) VALUES (?,?,?,?,?)",
+                    [(store_id, t["tkey"], t["display_name"], t["body"], ts) for t in DEFAULT_TEMPLATES])
+                conn.execute("INSERT OR IGNORE INTO store_settings (store_id, settings_json, updated_at) VALUES (?,?,?)",
+                             (store_id, orjson.dumps(DEFAULT_SETTINGS).decode(), now()))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+    await run_in_threadpool(_seed)
+    _cache_invalidate(store_id)
+
+
+# أعمدة تكفي اللوحة و /api/* — بدون access/refresh tokens الكبيرة (وثوابت SQL تسمح بإعادة استخدام العبارة المجهزة)
+_API_STORE_COLUMNS  = "store_id, store_domain, waba_token, waba_phone_id, plan, plan_until"
+_API_STORE_ONE_SQL  = f"SELECT {_API_STORE_COLUMNS} FROM merchants WHERE store_id=?"
+_API_STORE_LAST_SQL = f"SELECT {_API_STORE_COLUMNS} FROM merchants ORDER BY id DESC LIMIT 2"
+
+async def get_store(sid: Optional[str]) -> Optional[sqlite3.Row]:
+    # الصف كاملاً — لمسارات OAuth التي تحتاج الرموز
+    if sid:
+        return await db_fetchone("SELECT * FROM merchants WHERE store_id=?", (sid,))
+    # لو ما فيه sid وجِد متجر واحد فقط
+    row = await db_fetchall("SELECT * FROM merchants ORDER BY id DESC LIMIT 2")
     if not row:
-        cur.execute("INSERT OR IGNORE INTO store_settings (store_id, settings_json, updated_at) VALUES (?,?,?)",
-                    (store_id, json.dumps(DEFAULT_SETTINGS, ensure_ascii=False), now()))
-        conn.commit()
-    # قوالب
-    for t in DEFAULT_TEMPLATES:
-        cur.execute("INSERT OR IGNORE INTO templates (store_id, tkey, display_name, body) VALUES (?,?,?,?)",
-                    (store_id, t["tkey"], t["display_name"], t["body"]))
-    conn.commit()
-
+        return None
+    if len(row) == 1:
+        return row[0]
+    return None  # أكثر من متجر — نطلب sid
 
-def get_store(sid: Optional[str]) -> Optional[sqlite3.Row]:
+async def _get_store_for_api(sid: Optional[str]) -> Optional[sqlite3.Row]:
     if sid:
-        return cur.execute("SELECT * FROM merchants WHERE store_id=?", (sid,)).fetchone()
-    # لو ما فيه sid وجِد متجر واحد فقط
-    row = cur.execute("SELECT * FROM merchants ORDER BY id DESC LIMIT 2").fetchall()
+        return await db_fetchone(_API_STORE_ONE_SQL, (sid,))
+    row = await db_fetchall(_API_STORE_LAST_SQL)
     if not row:
         return None
     if len(row) == 1:
@@ -234,6 +521,46 @@ def get_store(sid: Optional[str]) -> Optional[sqlite3.Row]:
     return None  # أكثر من متجر — نطلب sid
 
 # =============== إرسال واتساب =======================
+# دلو رموز (token bucket) لكل متجر يفرض rate_limit_mps — قرار القبول O(1) بعمليتي float ومقارنة
+class Bucket:
+    __slots__ = ("rate", "tokens", "last")
+
+    def __init__(self, rate: float):
+        self.rate   = max(rate, 1.0)
+        self.tokens = self.rate  # يسمح بدفقة أولى بحجم المعدل
+        self.last   = time.monotonic()
+
+    def take(self) -> float:
+        # يعيد 0 لو مسموح فورًا، وإلا مدة الانتظار حتى يتوفر رمز
+        # الخصم غير مشروط (الرصيد قد يصبح سالبًا) — كل منتظر يحجز رمزه مسبقًا،
+        # فلا يتكدس المرسلون المتزامنون على نفس فترة الانتظار ثم ينطلقون معًا
+        t = time.monotonic()
+        self.tokens = min(self.rate, self.tokens + (t - self.last) * self.rate)
+        self.last = t
+        self.tokens -= 1.0
+        if self.tokens >= 0.0:
+            return 0.0
+        return -self.tokens / self.rate
+
+_BUCKETS: Dict[str, Bucket] = {}
+
+async def acquire_send_slot(store_id: str, rate: float):
+    b = _BUCKETS.get(store_id)
+    if b is None or b.rate != max(rate, 1.0):
+        b = _BUCKETS[store_id] = Bucket(rate)
+    delay = b.take()
+    if delay:
+        await asyncio.sleep(delay)
+
+async def _store_rate_limit(store_id: str) -> float:
+    cached = _cache_get(_SETTINGS_CACHE, store_id)
+    if cached is not None:
+        settings = cached[0]
+    else:
+        row = await db_fetchone("SELECT settings_json FROM store_settings WHERE store_id=?", (store_id,))
+        settings = orjson.loads(row["settings_json"]) if row and row["settings_json"] else DEFAULT_SETTINGS
+    return float(settings.get("rate_limit_mps") or DEFAULT_SETTINGS["rate_limit_mps"])
+
 async def send_whatsapp_text(waba_token: str, waba_phone_id: str, to_msisdn: str, body: str) -> Dict[str, Any]:
     url = f"{WABA_API_BASE}/{waba_phone_id}/messages"
     headers = {"Authorization": f"Bearer {waba_token}"}
@@ -243,365 +570,182 @@ async def send_whatsapp_text(waba_token: str, waba_phone_id: str, to_msisdn: str
         "type": "text",
         "text": {"preview_url": False, "body": body}
     }
-    async with httpx.AsyncClient(timeout=45) as client:
-        resp = await client.post(url, headers=headers, json=payload)
-        try:
-            data = resp.json()
-        except Exception:
-            data = {"text": await resp.aread()}
-        return {"status": resp.status_code, "data": data}
+    resp = await get_http_client().post(url, headers=headers, json=payload)
+    try:
+        data = resp.json()
+    except ValueError:
+        data = {"text": resp.text}  # الجسم مخزَّن مسبقًا لدى httpx — لا نسخة إضافية
+    return {"status": resp.status_code, "data": data}
 
 # =============== واجهة HTML (Dashboard) =============
-BASE_STYLE = """
-<style>
-  body{font-family:system-ui,Segoe UI,Arial;background:#0f172a;color:#e2e8f0;margin:0}
-  a{color:#67e8f9}
-  .wrap{max-width:1100px;margin:0 auto;padding:24px}
-  .grid{display:grid;gap:16px}
-  .g2{grid-template-columns:1fr 1fr}
-  .card{background:#111827;border:1px solid #334155;border-radius:16px;padding:18px}
-  input,select,textarea{width:100%;padding:10px;border-radius:12px;border:1px solid #334155;background:#0b1220;color:#e2e8f0}
-  label{display:block;margin:8px 0 6px;color:#cbd5e1}
-  .btn{display:inline-block;padding:10px 16px;border-radius:12px;background:#22d3ee;color:#0f172a;font-weight:700;text-decoration:none;border:none;cursor:pointer}
-  .btn-outline{background:transparent;color:#e2e8f0;border:1px solid #334155}
-  .switch{display:flex;align-items:center;gap:8px;margin:6px 0}
-  .muted{color:#94a3b8}
-  .badge{display:inline-block;padding:4px 10px;border-radius:999px;background:#0ea5e9;color:#0f172a;font-weight:700}
-  .row{display:flex;gap:10px;align-items:center}
-  .error{color:#fca5a5}
-</style>
-"""
-
-DASHBOARD_HTML = """
-<!doctype html><html lang='ar' dir='rtl'><head>
-<meta charset='utf-8'><meta name='viewport' content='width=device-width, initial-scale=1'>
-<title>لوحة Ferpoks WhatsApp AI</title>
-{STYLE}
-</head><body>
-  <main class='wrap'>
-    <h1>لوحة Ferpoks WhatsApp AI</h1>
-    <p class='muted'>اضبط مفاتيح واتساب، فعّل/عطّل الإشعارات، وعدّل القوالب. استخدم <span class='badge'>تجربة الإرسال</span> للتحقق فورًا.</p>
-
-    <div id='storeBar' class='card row'>
-      <div>المتجر: <b id='storeId'>—</b> • الخطة: <span id='plan' class='badge'>—</span></div>
-      <div style='flex:1'></div>
-      <button class='btn-outline' onclick='reload()'>تحديث</button>
-    </div>
-
-    <div class='grid g2'>
-      <section class='card'>
-        <h3>إعدادات واتساب (لكل متجر)</h3>
-        <label>WABA Token</label>
-        <input id='waba_token' type='password' placeholder='EAAG...'>
-        <label>WABA Phone ID</label>
-        <input id='waba_phone_id' placeholder='123456789012345'>
-        <div class='row' style='margin-top:10px'>
-          <button class='btn' onclick='saveWaba()'>حفظ</button>
-          <span id='waba_msg' class='muted'></span>
-        </div>
-      </section>
-
-      <section class='card'>
-        <h3>تجربة الإرسال</h3>
-        <label>رقم المرسل إليه (صيغة دولية، مثال 9665XXXXXXXX)</label>
-        <input id='test_msisdn' placeholder='9665XXXXXXXX'>
-        <label>اختر القالب</label>
-        <select id='test_template'></select>
-        <label>معاينة الرسالة (يتم استبدال المتغيرات القابلة)</label>
-        <textarea id='preview' rows='5' placeholder='المعاينة ستظهر هنا'></textarea>
-        <div class='row' style='margin-top:10px'>
-          <button class='btn' onclick='sendTest()'>إرسال اختبار</button>
-          <span id='test_msg' class='muted'></span>
-        </div>
-      </section>
-    </div>
-
-    <section class='card'>
-      <h3>الإشعارات المفعّلة</h3>
-      <div id='switches' class='grid g2'></div>
-      <div class='row' style='margin-top:10px'>
-        <button class='btn' onclick='saveSettings()'>حفظ الإعدادات</button>
-        <span id='settings_msg' class='muted'></span>
-      </div>
-      <p class='muted'>المتغيرات المدعومة في القوالب: {name} ، {order_no} ، {order_url} ، {tracking_no}</p>
-    </section>
-
-    <section class='card'>
-      <h3>القوالب</h3>
-      <div id='templates'></div>
-      <div class='row' style='margin-top:10px'>
-        <button class='btn' onclick='saveTemplates()'>حفظ القوالب</button>
-        <span id='tpl_msg' class='muted'></span>
-      </div>
-    </section>
-
-    <footer class='muted' style='margin-top:24px'>© Ferpoks 2025 • <a href='/privacy'>الخصوصية</a> • <a href='/terms'>الشروط</a> • <a href='/support'>الدعم</a></footer>
-  </main>
-
-<script>
-  const qs = new URLSearchParams(location.search);
-  const sid = qs.get('sid') || '';
-
-  const S = {
-    settings: null,
-    templates: [],
-    store: null,
-  };
-
-  async function api(path, method='GET', body=null){
-    const opt = {method, headers:{'Content-Type':'application/json'}};
-    if(body) opt.body = JSON.stringify(body);
-    const r = await fetch(path + (path.includes('?')?'&':'?') + new URLSearchParams({sid}), opt);
-    if(!r.ok){
-      const t = await r.text();
-      throw new Error('HTTP '+r.status+': '+t);
-    }
-    return r.json();
-  }
-
-  function el(tag, attrs={}, children=[]) {
-    const e = document.createElement(tag);
-    for (const k in attrs) {
-      if (k === 'class') e.className = attrs[k]; else if(k==='html') e.innerHTML = attrs[k]; else e.setAttribute(k, attrs[k]);
-    }
-    children.forEach(c => e.appendChild(c));
-    return e;
-  }
-
-  function renderSwitches(){
-    const container = document.getElementById('switches');
-    container.innerHTML = '';
-    const m = S.settings.enabled;
-    const items = [
-      ['order_created','تم إنشاء الطلب'],
-      ['order_paid','تم الدفع'],
-      ['order_fulfilled','تم الشحن'],
-      ['out_for_delivery','خارج للتسليم'],
-      ['delivered','تم التسليم'],
-      ['order_canceled','تم الإلغاء'],
-      ['refund_created','استرجاع']
-    ];
-    items.forEach(([key,label])=>{
-      const id = 'sw_'+key;
-      const row = el('div',{class:'switch'},[
-        el('input',{type:'checkbox', id, ...(m[key]?{checked:true}:{})}),
-        el('label',{for:id, html:label})
-      ]);
-      container.appendChild(row);
-    });
-  }
-
-  function renderTemplates(){
-    const box = document.getElementById('templates');
-    box.innerHTML = '';
-    S.templates.forEach((t,i)=>{
-      const wrap = el('div',{class:'card'},[
-        el('div',{class:'row'},[
-          el('div',{html:`<b>${t.display_name}</b> <span class='muted'>(key: ${t.tkey})</span>`}),
-        ]),
-        el('label',{html:'النص'}),
-        el('textarea',{rows:'3', id:'tpl_'+i},[]),
-      ]);
-      box.appendChild(wrap);
-      setTimeout(()=>{ document.getElementById('tpl_'+i).value = t.body; }, 0);
-    });
-  }
-
-  function currentTemplateBody(){
-    const sel = document.getElementById('test_template');
-    const t = S.templates.find(x=>x.tkey===sel.value);
-    return t? t.body: '';
-  }
-
-  function updatePreview(){
-    let body = currentTemplateBody();
-    body = body.replaceAll('{name}','عميلنا').replaceAll('{order_no}','12345').replaceAll('{order_url}','https://salla.sa/orders/12345').replaceAll('{tracking_no}','TRK123');
-    document.getElementById('preview').value = body;
-  }
-
-  async function loadAll(){
-    const info = await api('/api/store');
-    S.store = info.store;
-    document.getElementById('storeId').textContent = S.store? S.store.store_id : '—';
-    document.getElementById('plan').textContent = S.store? (S.store.plan || 'basic') : '—';
-
-    const set = await api('/api/settings');
-    S.settings = set.settings;
-    renderSwitches();
-
-    const tpls = await api('/api/templates');
-    S.templates = tpls.templates;
-    renderTemplates();
-
-    // تعبئة حقول واتساب
-    document.getElementById('waba_token').value = (S.store && S.store.waba_token) ? S.store.waba_token : '';
-    document.getElementById('waba_phone_id').value = (S.store && S.store.waba_phone_id) ? S.store.waba_phone_id : '';
-
-    // قائمة القوالب للتجربة
-    const sel = document.getElementById('test_template');
-    sel.innerHTML = '';
-    S.templates.forEach(t=>{
-      const o = document.createElement('option');
-      o.value = t.tkey; o.textContent = t.display_name;
-      sel.appendChild(o);
-    });
-    sel.addEventListener('change', updatePreview);
-    updatePreview();
-  }
-
-  async function saveWaba(){
-    const token = (document.getElementById('waba_token').value||'').trim();
-    const pid   = (document.getElementById('waba_phone_id').value||'').trim();
-    try{
-      await api('/api/waba','POST',{waba_token:token, waba_phone_id:pid});
-      document.getElementById('waba_msg').textContent = 'تم الحفظ ✅';
-    }catch(e){
-      document.getElementById('waba_msg').textContent = 'خطأ: '+e.message;
-    }
-  }
-
-  async function saveSettings(){
-    const m = S.settings.enabled;
-    const keys = Object.keys(m);
-    keys.forEach(k=>{
-      const elx = document.getElementById('sw_'+k);
-      if(elx) m[k] = !!elx.checked;
-    });
-    try{
-      await api('/api/settings','POST',{enabled:m, rate_limit_mps: S.settings.rate_limit_mps});
-      document.getElementById('settings_msg').textContent='تم الحفظ ✅';
-    }catch(e){
-      document.getElementById('settings_msg').textContent='خطأ: '+e.message;
-    }
-  }
-
-  async function saveTemplates(){
-    const out = S.templates.map((t,i)=> ({tkey:t.tkey, display_name:t.display_name, body: document.getElementById('tpl_'+i).value}));
-    try{
-      await api('/api/templates','POST',{templates: out});
-      document.getElementById('tpl_msg').textContent='تم الحفظ ✅';
-    }catch(e){
-      document.getElementById('tpl_msg').textContent='خطأ: '+e.message;
-    }
-  }
-
-  async function sendTest(){
-    const msisdn = (document.getElementById('test_msisdn').value||'').trim();
-    const body   = (document.getElementById('preview').value||'').trim();
-    if(!msisdn || !body){ document.getElementById('test_msg').textContent='يرجى إدخال رقم ومعاينة'; return; }
-    try{
-      const r = await api('/api/test-send','POST',{to_msisdn: msisdn, body});
-      document.getElementById('test_msg').textContent = 'الحالة: '+r.status;
-    }catch(e){
-      document.getElementById('test_msg').textContent = 'خطأ: '+e.message;
-    }
-  }
-
-  function reload(){ location.reload(); }
-
-  loadAll().catch(err=>{
-    document.getElementById('storeBar').insertAdjacentHTML('beforeend', `<span class='error'>${err.message}</span>`);
-  });
-</script>
-</body></html>
-""".replace("{STYLE}", BASE_STYLE)
+# الصفحات الكبيرة تعيش على القرص في static/ — تُقرأ عند أول طلب وتُضغط مرة واحدة،
+# بدل أن تُبنى عند الاستيراد وتبقى في ذاكرة كل عامل uvicorn
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+
+# صفحات ثابتة مضغوطة مع ETag — المتصفح يتخطى الجسم كليًا عند 304
+class _StaticPage:
+    __slots__ = ("path", "raw", "gz", "etag")
+
+    def __init__(self, filename: str):
+        self.path = os.path.join(STATIC_DIR, filename)
+        self.raw: Optional[bytes] = None
+        self.gz   = b""
+        self.etag = ""
+
+    def _load(self):
+        with open(self.path, "rb") as f:
+            self.raw = f.read()
+        self.gz   = gzip.compress(self.raw, 9)
+        self.etag = '"' + hashlib.md5(self.raw).hexdigest() + '"'
+
+    def serve(self, request: Request) -> Response:
+        if self.raw is None:
+            self._load()
+        if request.headers.get("if-none-match") == self.etag:
+            return Response(status_code=304, headers={"ETag": self.etag})
+        headers = {"ETag": self.etag, "Cache-Control": "private, max-age=60", "Vary": "Accept-Encoding"}
+        if "gzip" in request.headers.get("accept-encoding", ""):
+            headers["Content-Encoding"] = "gzip"
+            return Response(self.gz, headers=headers, media_type="text/html; charset=utf-8")
+        return Response(self.raw, headers=headers, media_type="text/html; charset=utf-8")
+
+DASHBOARD_PAGE    = _StaticPage("dashboard.html")
+CHOOSE_STORE_PAGE = _StaticPage("choose_store.html")
+PRIVACY_PAGE      = _StaticPage("privacy.html")
+TERMS_PAGE        = _StaticPage("terms.html")
+SUPPORT_PAGE      = _StaticPage("support.html")
 
 @app.get("/dashboard", response_class=HTMLResponse)
 async def dashboard(request: Request, sid: Optional[str] = None):
-    store = get_store(sid)
+    store = await _get_store_for_api(sid)
     if not store:
         # لا يوجد متجر أو يوجد أكثر من متجر بدون sid
-        html = f"""
-        <!doctype html><html lang='ar' dir='rtl'><head><meta charset='utf-8'>
-        <meta name='viewport' content='width=device-width, initial-scale=1'>
-        <title>اختر المتجر</title>{BASE_STYLE}</head><body>
-        <main class='wrap'>
-          <h2>لوحة Ferpoks — اختيار متجر</h2>
-          <div class='card'>لا يوجد متجر مرتبط بعد، أو لديك عدة متاجر. اربط عبر <code>/install</code> أو مرر ?sid=STORE_ID</div>
-        </main></body></html>
-        """
-        return HTMLResponse(html)
-    ensure_defaults(store["store_id"])
-    return HTMLResponse(DASHBOARD_HTML)
+        return CHOOSE_STORE_PAGE.serve(request)
+    await ensure_defaults(store["store_id"])
+    return DASHBOARD_PAGE.serve(request)
 
 # =============== API للوحة ==========================
 @app.get("/api/store")
-async def api_store(sid: Optional[str] = None):
-    store = get_store(sid)
+async def api_store(request: Request, sid: Optional[str] = None):
+    store = await _get_store_for_api(sid)
+    if not store:
+        raise HTTPException(404, "Store not found. استخدم ?sid=...")
+    etag = _etag_of(*tuple(store))
+    return _json_with_etag(request, {"store": dict(store)}, etag)
+
+async def _load_settings(store_id: str) -> tuple:
+    # (settings, etag) — عبر الكاش
+    cached = _cache_get(_SETTINGS_CACHE, store_id)
+    if cached is None:
+        row = await db_fetchone("SELECT settings_json FROM store_settings WHERE store_id=?", (store_id,))
+        raw = row["settings_json"] if row and row["settings_json"] else orjson.dumps(DEFAULT_SETTINGS).decode()
+        settings = orjson.loads(raw)
+        # ETag من المحتوى نفسه — updated_at بدقة ثانية فتتصادم كتابتان في نفس الثانية
+        etag = _etag_of(store_id, raw)
+        cached = (settings, etag)
+        _cache_put(_SETTINGS_CACHE, store_id, cached)
+    return cached
+
+async def _load_templates(store_id: str) -> tuple:
+    # (templates, etag) — عبر الكاش
+    cached = _cache_get(_TPL_CACHE, store_id)
+    if cached is None:
+        sql = "SELECT tkey, display_name, body FROM templates WHERE store_id=? ORDER BY id"
+        rows = await db_fetchall(sql, (store_id,))
+        if not rows:
+            await ensure_defaults(store_id)
+            rows = await db_fetchall(sql, (store_id,))
+        templates = [{"tkey": r["tkey"], "display_name": r["display_name"], "body": r["body"]} for r in rows]
+        # ETag من محتوى القوالب لا من updated_at — دقته ثانية واحدة فيتصادم تعديلان متتاليان
+        etag = _etag_of(store_id, orjson.dumps(templates).decode())
+        cached = (templates, etag)
+        _cache_put(_TPL_CACHE, store_id, cached)
+    return cached
+
+@app.get("/api/bootstrap")
+async def api_bootstrap(request: Request, sid: Optional[str] = None):
+    # اللوحة تفتح بنداء واحد بدل ثلاثة — RTT واحد وترميز JSON واحد
+    store = await _get_store_for_api(sid)
     if not store:
         raise HTTPException(404, "Store not found. استخدم ?sid=...")
-    return {"store": dict(store)}
+    settings, s_etag = await _load_settings(store["store_id"])
+    templates, t_etag = await _load_templates(store["store_id"])
+    etag = _etag_of(*tuple(store), s_etag, t_etag)
+    return _json_with_etag(request, {"store": dict(store), "settings": settings, "templates": templates}, etag)
 
 @app.get("/api/settings")
-async def api_get_settings(sid: Optional[str] = None):
-    store = get_store(sid)
+async def api_get_settings(request: Request, sid: Optional[str] = None):
+    store = await _get_store_for_api(sid)
     if not store:
         raise HTTPException(404, "Store not found")
-    row = cur.execute("SELECT settings_json FROM store_settings WHERE store_id=?", (store["store_id"],)).fetchone()
-    settings = json.loads(row[0]) if row and row[0] else DEFAULT_SETTINGS
-    return {"settings": settings}
+    settings, etag = await _load_settings(store["store_id"])
+    return _json_with_etag(request, {"settings": settings}, etag)
 
 @app.post("/api/settings")
 async def api_save_settings(request: Request, sid: Optional[str] = None):
-    store = get_store(sid)
+    store = await _get_store_for_api(sid)
     if not store:
         raise HTTPException(404, "Store not found")
-    body = await request.json()
+    body = orjson.loads(await request.body())
     enabled = body.get("enabled") or DEFAULT_SETTINGS["enabled"]
     rate_limit_mps = int(body.get("rate_limit_mps") or 60)
     settings = {"enabled": enabled, "rate_limit_mps": rate_limit_mps}
-    cur.execute("INSERT OR REPLACE INTO store_settings (store_id, settings_json, updated_at) VALUES (?,?,?)",
-                (store["store_id"], json.dumps(settings, ensure_ascii=False), now()))
-    conn.commit()
+    await db_write("INSERT OR REPLACE INTO store_settings (store_id, settings_json, updated_at) VALUES (?,?,?)",
+                   (store["store_id"], orjson.dumps(settings).decode(), now()))
+    _cache_invalidate(store["store_id"])
     return {"ok": True}
 
 @app.get("/api/templates")
-async def api_get_templates(sid: Optional[str] = None):
-    store = get_store(sid)
+async def api_get_templates(request: Request, sid: Optional[str] = None):
+    store = await _get_store_for_api(sid)
     if not store:
         raise HTTPException(404, "Store not found")
-    rows = cur.execute("SELECT tkey, display_name, body FROM templates WHERE store_id=? ORDER BY id", (store["store_id"],)).fetchall()
-    if not rows:
-        ensure_defaults(store["store_id"])
-        rows = cur.execute("SELECT tkey, display_name, body FROM templates WHERE store_id=? ORDER BY id", (store["store_id"],)).fetchall()
-    templates = [dict(r) for r in rows]
-    return {"templates": templates}
+    templates, etag = await _load_templates(store["store_id"])
+    return _json_with_etag(request, {"templates": templates}, etag)
 
 @app.post("/api/templates")
 async def api_save_templates(request: Request, sid: Optional[str] = None):
-    store = get_store(sid)
+    store = await _get_store_for_api(sid)
     if not store:
         raise HTTPException(404, "Store not found")
-    body = await request.json()
+    body = orjson.loads(await request.body())
     tpls: List[Dict[str, Any]] = body.get("templates") or []
+    rows = []
     for t in tpls:
         tkey = t.get("tkey"); disp = t.get("display_name") or tkey; txt = t.get("body") or ""
-        cur.execute("INSERT OR IGNORE INTO templates (store_id, tkey, display_name, body) VALUES (?,?,?,?)",
-                    (store["store_id"], tkey, disp, txt))
-        cur.execute("UPDATE templates SET display_name=?, body=? WHERE store_id=? AND tkey=?",
-                    (disp, txt, store["store_id"], tkey))
-    conn.commit()
+        if not validate_template(txt):
+            raise HTTPException(400, f"Invalid template braces in '{tkey}'")
+        rows.append((store["store_id"], tkey, disp, txt, now()))
+
+    def _save():
+        with _DB_LOCK:
+            conn.executemany("""INSERT INTO templates (store_id, tkey, display_name, body, updated_at) VALUES (?,?,?,?,?)
+                                ON CONFLICT(store_id, tkey) DO UPDATE SET display_name=excluded.display_name, body=excluded.body,
+                                                                          updated_at=excluded.updated_at""",
+                             rows)
+            conn.commit()
+    await run_in_threadpool(_save)
+    _cache_invalidate(store["store_id"])
     return {"ok": True}
 
 @app.post("/api/waba")
 async def api_save_waba(request: Request, sid: Optional[str] = None):
-    store = get_store(sid)
+    store = await _get_store_for_api(sid)
     if not store:
         raise HTTPException(404, "Store not found")
-    body = await request.json()
+    body = orjson.loads(await request.body())
     wtok = body.get("waba_token") or ""
     wpid = body.get("waba_phone_id") or ""
-    cur.execute("UPDATE merchants SET waba_token=?, waba_phone_id=? WHERE store_id=?",
-                (wtok, wpid, store["store_id"]))
-    conn.commit()
+    await db_write("UPDATE merchants SET waba_token=?, waba_phone_id=? WHERE store_id=?",
+                   (wtok, wpid, store["store_id"]))
     return {"ok": True}
 
 @app.post("/api/test-send")
 async def api_test_send(request: Request, sid: Optional[str] = None):
-    store = get_store(sid)
+    store = await _get_store_for_api(sid)
     if not store:
         raise HTTPException(404, "Store not found")
-    body = await request.json()
+    body = orjson.loads(await request.body())
     to_msisdn = (body.get("to_msisdn") or "").strip()
     msg_body  = (body.get("body") or "").strip()
     if not to_msisdn or not msg_body:
@@ -610,42 +754,24 @@ async def api_test_send(request: Request, sid: Optional[str] = None):
     wpid = store["waba_phone_id"] or GLOBAL_WABA_PHONE_ID
     if not wtk or not wpid:
         raise HTTPException(400, "WABA not configured for this store")
+    await acquire_send_slot(store["store_id"], await _store_rate_limit(store["store_id"]))
     res = await send_whatsapp_text(wtk, wpid, to_msisdn, msg_body)
-    cur.execute("INSERT INTO logs (store_id, to_msisdn, template, status, error, created_at) VALUES (?,?,?,?,?,?)",
-                (store["store_id"], to_msisdn, "manual_test", str(res.get("status")), json.dumps(res.get("data")), now()))
-    conn.commit()
+    _enqueue(LOG_Q, (store["store_id"], to_msisdn, "manual_test", str(res.get("status")),
+                     orjson.dumps(res.get("data")).decode(), now()))
     return {"status": res.get("status"), "data": res.get("data")}
 
 # صفحات عامة بسيطة
 @app.get("/privacy", response_class=HTMLResponse)
-async def privacy():
-    return HTMLResponse("""
-    <!doctype html><html lang='ar' dir='rtl'><head><meta charset='utf-8'><meta name='viewport' content='width=device-width, initial-scale=1'>
-    <title>سياسة الخصوصية</title>"""+BASE_STYLE+"""
-    </head><body><main class='wrap'><h2>سياسة الخصوصية</h2>
-    <p>يجمع التطبيق بيانات لازمة لتقديم الإشعارات ولا يبيعها لطرف ثالث. تُخزّن المفاتيح بشكل آمن. للاستفسار: support@ferpoks.com.</p>
-    </main></body></html>
-    """)
+async def privacy(request: Request):
+    return PRIVACY_PAGE.serve(request)
 
 @app.get("/terms", response_class=HTMLResponse)
-async def terms():
-    return HTMLResponse("""
-    <!doctype html><html lang='ar' dir='rtl'><head><meta charset='utf-8'><meta name='viewport' content='width=device-width, initial-scale=1'>
-    <title>الشروط والأحكام</title>"""+BASE_STYLE+"""
-    </head><body><main class='wrap'><h2>الشروط والأحكام</h2>
-    <ul><li>الاشتراك شهري/سنوي عبر سلة، قابل للإلغاء.</li><li>تكلفة رسائل واتساب على مزوّد العميل.</li><li>الالتزام بسياسات سلة وواتساب.</li></ul>
-    </main></body></html>
-    """)
+async def terms(request: Request):
+    return TERMS_PAGE.serve(request)
 
 @app.get("/support", response_class=HTMLResponse)
-async def support():
-    return HTMLResponse("""
-    <!doctype html><html lang='ar' dir='rtl'><head><meta charset='utf-8'><meta name='viewport' content='width=device-width, initial-scale=1'>
-    <title>الدعم</title>"""+BASE_STYLE+"""
-    </head><body><main class='wrap'><h2>الدعم الفني</h2>
-    <p>راسلنا على support@ferpoks.com أو تيليجرام @Ferpoks</p>
-    </main></body></html>
-    """)
+async def support(request: Request):
+    return SUPPORT_PAGE.serve(request)
 
 @app.get("/health")
 async def health():